@@ -1,95 +1,432 @@
+import logging
 import time
 import threading
-from collections import defaultdict, deque
-from typing import Dict, List, Optional
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
 import math
 
+
+logger = logging.getLogger(__name__)
+
+
+# Lock striping: every limiter splits its keys over _NUM_SHARDS independent
+# (lock, table) pairs chosen by hash(key), so unrelated keys rarely contend.
+_SHARD_BITS = 6
+_NUM_SHARDS = 1 << _SHARD_BITS
+_SHARD_MASK = _NUM_SHARDS - 1
+
+
+def _make_shards() -> List[Tuple[threading.Lock, Dict]]:
+    return [(threading.Lock(), {}) for _ in range(_NUM_SHARDS)]
+
+
+def _group_by_shard(keys: List[str]) -> Dict[int, List[int]]:
+    """Map shard index -> positions in keys, preserving order within a shard"""
+    groups: Dict[int, List[int]] = {}
+    for i, key in enumerate(keys):
+        shard = hash(key) & _SHARD_MASK
+        positions = groups.get(shard)
+        if positions is None:
+            groups[shard] = [i]
+        else:
+            positions.append(i)
+    return groups
+
+
+def _evict_idle(shards: List[Tuple[threading.Lock, Dict]], is_idle) -> int:
+    """Drop entries whose state satisfies is_idle, locking one shard at a time"""
+    evicted = 0
+    for lock, table in shards:
+        with lock:
+            idle_keys = [key for key, state in table.items() if is_idle(state)]
+            for key in idle_keys:
+                del table[key]
+        evicted += len(idle_keys)
+    return evicted
+
+
+# All limiters measure time as integer nanoseconds from time.monotonic_ns(),
+# so wall-clock jumps cannot corrupt state and comparisons stay integral.
+# Each class binds the clock as _now, saving a module attribute lookup per
+# call and letting a test swap in a fake clock per class or instance.
+# Token and leaky bucket levels are fixed point with _NS_PER_SEC units per
+# request, which makes a rate in requests/second equal to units/nanosecond.
+_NS_PER_SEC = 1_000_000_000
+
+
+# Fixed window state is packed into one int: (window_id << 32) | count.
+# A single dict read then yields a consistent (window, count) snapshot.
+_COUNT_BITS = 32
+_COUNT_MASK = (1 << _COUNT_BITS) - 1
+
+
+# Sliding window counter state is an immutable (window_start_ns, previous,
+# current) tuple that is swapped whole under the shard lock, so readers
+# outside the lock always see a consistent snapshot.
+_EMPTY_WINDOW = (0, 0, 0)
+
+
+class _AdmissionFilter:
+    """
+    Bloom filter of the keys a fixed window shard has admitted this window
+    - Lets a key's first request be allowed without creating a table entry
+    - Cleared whenever the window moves on
+    - Sized for `capacity` keys at false positive rate `fp_rate`; once full,
+      further new keys go to the table instead, so the rate never degrades
+    - A false positive makes a new key's first request count as its second,
+      so limits are never exceeded but the key loses one request
+    """
+    
+    __slots__ = ('bits', 'size', 'capacity', 'added', 'window')
+    
+    def __init__(self, capacity: int, fp_rate: float):
+        # With two probes per key the false positive rate at n keys in m bits
+        # is (1 - e^(-2n/m))^2; solve for m at n = capacity. Probes are 32-bit,
+        # so m is capped at 2**32 bits
+        size = math.ceil(-2 * capacity / math.log(1 - math.sqrt(fp_rate)))
+        self.bits = bytearray((min(max(8, size), 1 << 32) + 7) // 8)
+        self.size = len(self.bits) * 8
+        self.capacity = capacity
+        self.added = 0
+        self.window = -1
+    
+    def _probes(self, key_hash: int) -> Tuple[int, int]:
+        # Fibonacci hashing; keys in one shard share their low hash bits, so
+        # the first probe takes the product's well-mixed high 32 bits and
+        # the second folds them into the low 32
+        h = (key_hash * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        high = h >> 32
+        return high % self.size, ((h ^ high) & 0xFFFFFFFF) % self.size
+    
+    def contains(self, key_hash: int) -> bool:
+        bits = self.bits
+        i, j = self._probes(key_hash)
+        return bool(bits[i >> 3] & (1 << (i & 7)) and bits[j >> 3] & (1 << (j & 7)))
+    
+    def admit(self, key_hash: int, window: int) -> Optional[int]:
+        """
+        Handle a request from a key with no table entry: None if the key was
+        recorded as new (allow it; only the filter remembers it), otherwise
+        the packed state to count the request from
+        """
+        if window > self.window:
+            self.bits = bytearray(len(self.bits))
+            self.added = 0
+            self.window = window
+        
+        bits = self.bits
+        i, j = self._probes(key_hash)
+        bit_i = 1 << (i & 7)
+        bit_j = 1 << (j & 7)
+        if bits[i >> 3] & bit_i and bits[j >> 3] & bit_j:
+            # Possibly admitted through the filter already; count it. A late
+            # clock reading counts toward the filter's newer window, just as
+            # it would toward a newer table entry
+            return (self.window << _COUNT_BITS) | 1
+        if self.added >= self.capacity:
+            return 0
+        bits[i >> 3] |= bit_i
+        bits[j >> 3] |= bit_j
+        self.added += 1
+        return None
+
+
+# Per-key state containers. __slots__ keeps each entry to a few fixed
+# attribute offsets instead of a hashed dict lookup per field.
+class _SlidingLogState:
+    __slots__ = ('ring', 'head')
+
+    def __init__(self):
+        # Ring of the last `limit` request timestamps (8 bytes each). It grows
+        # by appending until it holds `limit`, so memory follows actual use;
+        # head is the oldest slot once the ring is full
+        self.ring = array('q')
+        self.head = 0
+
+
+class _TokenBucketState:
+    __slots__ = ('tokens', 'last_refill')
+
+    def __init__(self, tokens: int, last_refill: int):
+        self.tokens = tokens
+        self.last_refill = last_refill
+
+
+class _LeakyBucketState:
+    __slots__ = ('level', 'last_leak')
+
+    def __init__(self, last_leak: int):
+        self.level = 0  # queued requests, fixed point
+        self.last_leak = last_leak
+
+
 class FixedWindowRateLimiter:
     """
     Fixed Window Counter Algorithm
     - Simple and memory efficient
     - Has burst problem at window boundaries
+    - Optional admission filter (admission_filter_keys > 0, the expected
+      distinct keys per window) keeps keys seen only once per window, e.g.
+      login attempts, out of the state tables. It trades CPU for memory:
+      ~0.3 MB instead of ~6.5 MB for 100k one-off keys, but a key's first
+      request costs ~1.5x and its second ~1.8x (later ones are unaffected),
+      and each false positive (admission_filter_fp_rate) costs a key one
+      request
     """
     
-    def __init__(self, limit: int, window_size: int):
+    _now = staticmethod(time.monotonic_ns)
+    
+    def __init__(self, limit: int, window_size: int, admission_filter_keys: int = 0,
+                 admission_filter_fp_rate: float = 0.01):
+        if not 0 < admission_filter_fp_rate < 1:
+            raise ValueError(f"admission_filter_fp_rate must be between 0 and 1, "
+                             f"got {admission_filter_fp_rate!r}")
+        # The count must fit its 32 bits of the packed state
+        if limit > _COUNT_MASK:
+            raise ValueError(f"limit must be below 2**{_COUNT_BITS}, got {limit!r}")
         self.limit = limit
         self.window_size = window_size  # in seconds
-        self.counters: Dict[str, Dict] = defaultdict(lambda: {'count': 0, 'window_start': 0})
-        self.lock = threading.Lock()
+        self._window_size_ns = int(window_size * _NS_PER_SEC)
+        # Shard tables map key -> (window_start << 32) | count
+        self._shards = _make_shards()
+        # The filter relies on every key's first request being allowed, and a
+        # false positive costs the key one request, so it needs limit >= 2
+        if admission_filter_keys > 0 and limit >= 2:
+            shard_keys = -(-admission_filter_keys // _NUM_SHARDS)
+            self._filters = [_AdmissionFilter(shard_keys, admission_filter_fp_rate)
+                             for _ in range(_NUM_SHARDS)]
+        else:
+            self._filters = [None] * _NUM_SHARDS
     
     def is_allowed(self, key: str) -> bool:
-        with self.lock:
-            current_time = time.time()
-            current_window = int(current_time // self.window_size)
-            
-            counter_data = self.counters[key]
-            
-            # Reset counter if we're in a new window
-            if counter_data['window_start'] != current_window:
-                counter_data['count'] = 0
-                counter_data['window_start'] = current_window
-            
-            # Check if request is allowed
-            if counter_data['count'] < self.limit:
-                counter_data['count'] += 1
+        current_window = self._now() // self._window_size_ns
+        key_hash = hash(key)
+        shard = key_hash & _SHARD_MASK
+        lock, counters = self._shards[shard]
+        with lock:
+            # _check_locked inlined: only a key without an entry consults
+            # the admission filter
+            packed = counters.get(key)
+            if packed is None:
+                admission = self._filters[shard]
+                if admission is None:
+                    packed = 0
+                else:
+                    packed = admission.admit(key_hash, current_window)
+                    if packed is None:
+                        return True
+            if packed >> _COUNT_BITS >= current_window:
+                if packed & _COUNT_MASK < self.limit:
+                    counters[key] = packed + 1
+                    return True
+                return False
+            if self.limit > 0:
+                counters[key] = (current_window << _COUNT_BITS) | 1
                 return True
-            
             return False
     
+    def check(self, key: str) -> Tuple[bool, Dict]:
+        """
+        Decide on one request and return the stats that decision saw,
+        from a single locked section
+        """
+        current_window = self._now() // self._window_size_ns
+        key_hash = hash(key)
+        shard = key_hash & _SHARD_MASK
+        lock, counters = self._shards[shard]
+        admission = self._filters[shard]
+        with lock:
+            allowed = self._check_locked(counters, key, key_hash, current_window, admission)
+            packed = self._snapshot(counters, key, key_hash, current_window, admission)
+        return allowed, self._stats(packed)
+    
+    def is_allowed_batch(self, keys: Iterable[str]) -> List[bool]:
+        """
+        Check many keys in one call, in order, with a single clock read and
+        one lock acquisition per shard touched
+        """
+        keys = list(keys)
+        results = [False] * len(keys)
+        current_window = self._now() // self._window_size_ns
+        
+        for shard, positions in _group_by_shard(keys).items():
+            lock, counters = self._shards[shard]
+            admission = self._filters[shard]
+            with lock:
+                for i in positions:
+                    key = keys[i]
+                    results[i] = self._check_locked(counters, key, hash(key), current_window, admission)
+        
+        return results
+    
     def get_stats(self, key: str) -> Dict:
-        counter_data = self.counters[key]
+        key_hash = hash(key)
+        shard = key_hash & _SHARD_MASK
+        _, counters = self._shards[shard]
+        admission = self._filters[shard]
+        # A single packed read is already a consistent snapshot; no lock needed
+        if admission is None:
+            return self._stats(counters.get(key, 0))
+        current_window = self._now() // self._window_size_ns
+        return self._stats(self._snapshot(counters, key, key_hash, current_window, admission))
+    
+    def _snapshot(self, counters: Dict[str, int], key: str, key_hash: int, current_window: int,
+                  admission: Optional[_AdmissionFilter]) -> int:
+        packed = counters.get(key)
+        if packed is None:
+            # A key admitted only through the filter has made one request
+            if (admission is not None and admission.window >= current_window
+                    and admission.contains(key_hash)):
+                return (admission.window << _COUNT_BITS) | 1
+            return 0
+        return packed
+    
+    def _check_locked(self, counters: Dict[str, int], key: str, key_hash: int,
+                      current_window: int, admission: Optional[_AdmissionFilter]) -> bool:
+        packed = counters.get(key)
+        if packed is None:
+            if admission is None:
+                packed = 0
+            else:
+                packed = admission.admit(key_hash, current_window)
+                if packed is None:
+                    # First request for this key in this window: always
+                    # allowed, and only the filter remembers it
+                    return True
+        
+        if packed >> _COUNT_BITS >= current_window:
+            # Same window (or another thread already moved to the next one):
+            # the count is the low bits, so an increment bumps it in place
+            if packed & _COUNT_MASK < self.limit:
+                counters[key] = packed + 1
+                return True
+            return False
+        
+        # Reset counter if we're in a new window
+        if self.limit > 0:
+            counters[key] = (current_window << _COUNT_BITS) | 1
+            return True
+        
+        return False
+    
+    def _stats(self, packed: int) -> Dict:
+        count = packed & _COUNT_MASK
+        limit = self.limit
         return {
-            'requests_made': counter_data['count'],
-            'limit': self.limit,
-            'remaining': max(0, self.limit - counter_data['count']),
-            'window_start': counter_data['window_start']
+            'requests_made': count,
+            'limit': limit,
+            'remaining': max(0, limit - count),
+            'window_start': packed >> _COUNT_BITS
         }
+    
+    def evict_idle(self) -> int:
+        """
+        Forget keys whose state is indistinguishable from a fresh key
+        (their window has passed); returns the number of keys evicted
+        """
+        current_window = self._now() // self._window_size_ns
+        return _evict_idle(self._shards,
+                           lambda packed: packed >> _COUNT_BITS < current_window)
 
 
 class SlidingWindowLogRateLimiter:
     """
     Sliding Window Log Algorithm
     - Most accurate but memory intensive
-    - Stores timestamp of every request
+    - Stores timestamp of every request (at most `limit` per key)
+    - Opt-in for audit/precise limits; hot paths should prefer the
+      sliding window counter (up to 8 bytes * limit vs three ints per key)
     """
     
+    _now = staticmethod(time.monotonic_ns)
+    
     def __init__(self, limit: int, window_size: int):
         self.limit = limit
         self.window_size = window_size
-        self.logs: Dict[str, deque] = defaultdict(deque)
-        self.lock = threading.Lock()
+        self._window_size_ns = int(window_size * _NS_PER_SEC)
+        self._shards = _make_shards()  # key -> _SlidingLogState
     
     def is_allowed(self, key: str) -> bool:
-        with self.lock:
-            current_time = time.time()
-            request_log = self.logs[key]
-            
-            # Remove expired requests
-            cutoff_time = current_time - self.window_size
-            while request_log and request_log[0] < cutoff_time:
-                request_log.popleft()
-            
-            # Check if request is allowed
-            if len(request_log) < self.limit:
-                request_log.append(current_time)
-                return True
-            
-            return False
+        lock, logs = self._shards[hash(key) & _SHARD_MASK]
+        with lock:
+            return self._check_locked(logs, key, self._now())
+    
+    def check(self, key: str) -> Tuple[bool, Dict]:
+        """
+        Decide on one request and return the stats that decision saw,
+        from a single locked section
+        """
+        lock, logs = self._shards[hash(key) & _SHARD_MASK]
+        with lock:
+            current_time = self._now()
+            allowed = self._check_locked(logs, key, current_time)
+            return allowed, self._stats_locked(logs.get(key), current_time)
     
     def get_stats(self, key: str) -> Dict:
-        current_time = time.time()
-        request_log = self.logs[key]
+        lock, logs = self._shards[hash(key) & _SHARD_MASK]
+        with lock:
+            return self._stats_locked(logs.get(key), self._now())
+    
+    def _check_locked(self, logs: Dict[str, _SlidingLogState], key: str, current_time: int) -> bool:
+        limit = self.limit
+        if limit <= 0:
+            return False
         
-        # Count requests in current window
-        cutoff_time = current_time - self.window_size
-        active_requests = sum(1 for timestamp in request_log if timestamp >= cutoff_time)
+        request_log = logs.get(key)
+        if request_log is None:
+            request_log = logs[key] = _SlidingLogState()
+        
+        ring = request_log.ring
+        
+        # Ring not yet full: head is still 0, so append
+        if len(ring) < limit:
+            ring.append(current_time)
+            return True
+        
+        # Ring full: allowed only if the oldest request has expired, in
+        # which case its slot is reused and head moves to the next oldest
+        head = request_log.head
+        if ring[head] < current_time - self._window_size_ns:
+            ring[head] = current_time
+            head += 1
+            request_log.head = head if head < limit else 0
+            return True
+        
+        return False
+    
+    def _stats_locked(self, request_log: Optional[_SlidingLogState], current_time: int) -> Dict:
+        if request_log is None:
+            active_requests = 0
+            oldest_request = None
+        else:
+            # Count requests in current window
+            cutoff_time = current_time - self._window_size_ns
+            ring = request_log.ring
+            active_requests = sum(1 for timestamp in ring if timestamp >= cutoff_time)
+            oldest_request = ring[request_log.head] if ring else None
         
+        limit = self.limit
         return {
             'requests_made': active_requests,
-            'limit': self.limit,
-            'remaining': max(0, self.limit - active_requests),
-            'oldest_request': request_log[0] if request_log else None
+            'limit': limit,
+            'remaining': max(0, limit - active_requests),
+            'oldest_request': oldest_request
         }
+    
+    def evict_idle(self) -> int:
+        """
+        Forget keys whose state is indistinguishable from a fresh key
+        (every logged request has expired); returns the number of keys evicted
+        """
+        cutoff_time = self._now() - self._window_size_ns
+        
+        def is_idle(request_log: _SlidingLogState) -> bool:
+            # The newest timestamp sits just before head (the last slot while
+            # the ring is still growing, as head is then 0)
+            ring = request_log.ring
+            return not ring or ring[request_log.head - 1] < cutoff_time
+        
+        return _evict_idle(self._shards, is_idle)
 
 
 class SlidingWindowCounterRateLimiter:
@@ -97,61 +434,119 @@ class SlidingWindowCounterRateLimiter:
     Sliding Window Counter Algorithm
     - Balance between accuracy and efficiency
     - Uses weighted count from previous window
+    - Default strategy of make_limiter(); the weighting assumes requests in
+      the previous window were evenly spread, which bounds the error
     """
     
+    _now = staticmethod(time.monotonic_ns)
+    
     def __init__(self, limit: int, window_size: int):
         self.limit = limit
         self.window_size = window_size
-        self.windows: Dict[str, Dict] = defaultdict(lambda: {'current': 0, 'previous': 0, 'current_start': 0})
-        self.lock = threading.Lock()
+        self._window_size_ns = int(window_size * _NS_PER_SEC)
+        self._limit_scaled = limit * self._window_size_ns  # limit, scaled like weighted counts
+        self._inv_window = 1.0 / self._window_size_ns
+        self._shards = _make_shards()  # key -> (window_start_ns, previous, current)
     
     def is_allowed(self, key: str) -> bool:
-        with self.lock:
-            current_time = time.time()
-            current_window = int(current_time // self.window_size)
-            
-            window_data = self.windows[key]
-            
-            # Check if we need to slide the window
-            if window_data['current_start'] != current_window:
-                if window_data['current_start'] == current_window - 1:
-                    # Move to next window
-                    window_data['previous'] = window_data['current']
-                else:
-                    # Jumped multiple windows (user was inactive)
-                    window_data['previous'] = 0
-                
-                window_data['current'] = 0
-                window_data['current_start'] = current_window
-            
-            # Calculate weighted count
-            time_in_current_window = current_time - (current_window * self.window_size)
-            weight = 1 - (time_in_current_window / self.window_size)
-            weighted_count = (window_data['previous'] * weight) + window_data['current']
-            
-            # Check if request is allowed
-            if weighted_count < self.limit:
-                window_data['current'] += 1
-                return True
-            
-            return False
+        current_time = self._now()
+        lock, windows = self._shards[hash(key) & _SHARD_MASK]
+        with lock:
+            # _check_locked inlined for the common same-window case; new
+            # keys and window slides take the full path
+            window_data = windows.get(key)
+            if window_data is not None:
+                window_size_ns = self._window_size_ns
+                window_start, previous, current = window_data
+                time_in_window = current_time - window_start
+                if 0 <= time_in_window < window_size_ns:
+                    if (previous * (window_size_ns - time_in_window) + current * window_size_ns
+                            < self._limit_scaled):
+                        windows[key] = (window_start, previous, current + 1)
+                        return True
+                    return False
+            return self._check_locked(windows, key, current_time)
+    
+    def check(self, key: str) -> Tuple[bool, Dict]:
+        """
+        Decide on one request and return the stats that decision saw,
+        from a single locked section
+        """
+        lock, windows = self._shards[hash(key) & _SHARD_MASK]
+        with lock:
+            current_time = self._now()
+            allowed = self._check_locked(windows, key, current_time)
+            return allowed, self._stats(windows.get(key, _EMPTY_WINDOW), current_time)
     
     def get_stats(self, key: str) -> Dict:
-        current_time = time.time()
-        current_window = int(current_time // self.window_size)
-        window_data = self.windows[key]
+        _, windows = self._shards[hash(key) & _SHARD_MASK]
+        # The state tuple is replaced whole, so no lock is needed to read it
+        return self._stats(windows.get(key, _EMPTY_WINDOW), self._now())
+    
+    def _check_locked(self, windows: Dict[str, Tuple[int, int, int]], key: str, current_time: int) -> bool:
+        window_size_ns = self._window_size_ns
+        window_start, previous, current = windows.get(key, _EMPTY_WINDOW)
+        
+        # Same window while the stored start is less than one window ago;
+        # only a slide needs the modulus to find the new window's start
+        time_in_window = current_time - window_start
+        slid = False
+        if time_in_window >= window_size_ns:
+            current_start = current_time - current_time % window_size_ns
+            if current_start - window_start == window_size_ns:
+                # Move to next window
+                previous = current
+            else:
+                # Jumped multiple windows (user was inactive)
+                previous = 0
+            
+            current = 0
+            window_start = current_start
+            time_in_window = current_time - current_start
+            slid = True
+        elif time_in_window < 0:
+            # Another thread read a later clock and already slid; treat
+            # this request as arriving at the start of that window
+            time_in_window = 0
+        
+        # Weighted count, kept in integers by scaling both sides by the
+        # window length: previous * weight + current < limit
+        weighted_count = previous * (window_size_ns - time_in_window) + current * window_size_ns
         
-        time_in_current_window = current_time - (current_window * self.window_size)
-        weight = 1 - (time_in_current_window / self.window_size)
-        weighted_count = (window_data['previous'] * weight) + window_data['current']
+        # Check if request is allowed
+        if weighted_count < self._limit_scaled:
+            windows[key] = (window_start, previous, current + 1)
+            return True
+        
+        if slid:
+            windows[key] = (window_start, previous, current)
+        return False
+    
+    def _stats(self, window_data: Tuple[int, int, int], current_time: int) -> Dict:
+        window_start, previous, current = window_data
+        limit = self.limit
+        
+        time_in_window = (current_time - window_start) % self._window_size_ns
+        weighted_count = previous * (1.0 - time_in_window * self._inv_window) + current
         
         return {
             'weighted_count': weighted_count,
-            'current_window_requests': window_data['current'],
-            'previous_window_requests': window_data['previous'],
-            'limit': self.limit,
-            'remaining': max(0, self.limit - weighted_count)
+            'current_window_requests': current,
+            'previous_window_requests': previous,
+            'limit': limit,
+            'remaining': max(0, limit - weighted_count)
         }
+    
+    def evict_idle(self) -> int:
+        """
+        Forget keys whose state is indistinguishable from a fresh key
+        (neither window overlaps the previous one); returns the number of keys evicted
+        """
+        current_time = self._now()
+        window_size_ns = self._window_size_ns
+        previous_start = current_time - current_time % window_size_ns - window_size_ns
+        return _evict_idle(self._shards,
+                           lambda window_data: window_data[0] < previous_start)
 
 
 class TokenBucketRateLimiter:
@@ -161,41 +556,130 @@ class TokenBucketRateLimiter:
     - Tokens are added at a steady rate
     """
     
+    _now = staticmethod(time.monotonic_ns)
+    
     def __init__(self, capacity: int, refill_rate: float):
         self.capacity = capacity  # max tokens in bucket
         self.refill_rate = refill_rate  # tokens per second
-        self.buckets: Dict[str, Dict] = defaultdict(lambda: {
-            'tokens': capacity,
-            'last_refill': time.time()
-        })
-        self.lock = threading.Lock()
+        self._capacity_units = int(capacity * _NS_PER_SEC)
+        self._shards = _make_shards()  # key -> _TokenBucketState
     
     def is_allowed(self, key: str, tokens_requested: int = 1) -> bool:
-        with self.lock:
-            current_time = time.time()
-            bucket = self.buckets[key]
-            
-            # Refill tokens
-            time_passed = current_time - bucket['last_refill']
-            tokens_to_add = time_passed * self.refill_rate
-            bucket['tokens'] = min(self.capacity, bucket['tokens'] + tokens_to_add)
-            bucket['last_refill'] = current_time
-            
-            # Check if request is allowed
-            if bucket['tokens'] >= tokens_requested:
-                bucket['tokens'] -= tokens_requested
-                return True
-            
-            return False
+        lock, buckets = self._shards[hash(key) & _SHARD_MASK]
+        with lock:
+            if tokens_requested == 1:
+                return self._allow_one_locked(buckets, key, self._now())
+            return self._check_locked(buckets, key, self._now(), tokens_requested)
+    
+    def check(self, key: str, tokens_requested: int = 1) -> Tuple[bool, Dict]:
+        """
+        Decide on one request and return the stats that decision saw,
+        from a single locked section
+        """
+        lock, buckets = self._shards[hash(key) & _SHARD_MASK]
+        with lock:
+            current_time = self._now()
+            allowed = self._check_locked(buckets, key, current_time, tokens_requested)
+            return allowed, self._stats_locked(buckets.get(key), current_time)
+    
+    def is_allowed_batch(self, keys: Iterable[str]) -> List[bool]:
+        """
+        Check many keys (one token each) in one call, in order, with a single
+        clock read and one lock acquisition per shard touched
+        """
+        keys = list(keys)
+        results = [False] * len(keys)
+        current_time = self._now()
+        
+        for shard, positions in _group_by_shard(keys).items():
+            lock, buckets = self._shards[shard]
+            with lock:
+                for i in positions:
+                    results[i] = self._allow_one_locked(buckets, keys[i], current_time)
+        
+        return results
     
     def get_stats(self, key: str) -> Dict:
-        bucket = self.buckets[key]
+        lock, buckets = self._shards[hash(key) & _SHARD_MASK]
+        with lock:
+            return self._stats_locked(buckets.get(key), self._now())
+    
+    def _check_locked(self, buckets: Dict[str, _TokenBucketState], key: str,
+                      current_time: int, tokens_requested: int) -> bool:
+        # Refill skips full buckets, so a negative cost would overfill one
+        # for good
+        if tokens_requested < 0:
+            raise ValueError(f"tokens_requested must be non-negative, got {tokens_requested!r}")
+        capacity = self._capacity_units
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = _TokenBucketState(capacity, current_time)
+        
+        # Refill tokens; a full bucket needs no arithmetic, and the cap is a
+        # plain comparison rather than a min() call. A batch's clock reading
+        # may predate this bucket's last refill, in which case nothing is added.
+        tokens = bucket.tokens
+        time_passed = current_time - bucket.last_refill
+        if time_passed > 0:
+            if tokens < capacity:
+                tokens += int(time_passed * self.refill_rate)
+                if tokens > capacity:
+                    tokens = capacity
+            bucket.last_refill = current_time
+        
+        # Check if request is allowed
+        cost = tokens_requested * _NS_PER_SEC
+        if tokens >= cost:
+            bucket.tokens = tokens - cost
+            return True
+        
+        bucket.tokens = tokens
+        return False
+    
+    def _allow_one_locked(self, buckets: Dict[str, _TokenBucketState], key: str,
+                          current_time: int) -> bool:
+        # Same as _check_locked specialised for the default single token, so
+        # the common call skips the cost multiply and variable comparison
+        capacity = self._capacity_units
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = _TokenBucketState(capacity, current_time)
+        
+        tokens = bucket.tokens
+        time_passed = current_time - bucket.last_refill
+        if time_passed > 0:
+            if tokens < capacity:
+                tokens += int(time_passed * self.refill_rate)
+                if tokens > capacity:
+                    tokens = capacity
+            bucket.last_refill = current_time
+        
+        if tokens >= _NS_PER_SEC:
+            bucket.tokens = tokens - _NS_PER_SEC
+            return True
+        
+        bucket.tokens = tokens
+        return False
+    
+    def _stats_locked(self, bucket: Optional[_TokenBucketState], current_time: int) -> Dict:
+        bucket = bucket or _TokenBucketState(self._capacity_units, current_time)
         return {
-            'available_tokens': bucket['tokens'],
+            'available_tokens': bucket.tokens / _NS_PER_SEC,
             'capacity': self.capacity,
             'refill_rate': self.refill_rate,
-            'last_refill': bucket['last_refill']
+            'last_refill': bucket.last_refill
         }
+    
+    def evict_idle(self) -> int:
+        """
+        Forget keys whose state is indistinguishable from a fresh key
+        (the bucket has refilled completely); returns the number of keys evicted
+        """
+        current_time = self._now()
+        capacity = self._capacity_units
+        refill_rate = self.refill_rate
+        return _evict_idle(self._shards, lambda bucket: (
+            bucket.tokens + (current_time - bucket.last_refill) * refill_rate >= capacity))
 
 
 class LeakyBucketRateLimiter:
@@ -203,46 +687,317 @@ class LeakyBucketRateLimiter:
     Leaky Bucket Algorithm
     - Smooths traffic by processing requests at fixed rate
     - Can introduce latency as requests are queued
+    - Tracks only the queue level per key, which drains at leak_rate
     """
     
+    _now = staticmethod(time.monotonic_ns)
+    
     def __init__(self, capacity: int, leak_rate: float):
         self.capacity = capacity  # max queue size
         self.leak_rate = leak_rate  # requests processed per second
-        self.buckets: Dict[str, Dict] = defaultdict(lambda: {
-            'queue': deque(),
-            'last_leak': time.time()
-        })
-        self.lock = threading.Lock()
+        self._capacity_units = int(capacity * _NS_PER_SEC)
+        self._shards = _make_shards()  # key -> _LeakyBucketState
     
     def is_allowed(self, key: str) -> bool:
-        with self.lock:
-            current_time = time.time()
-            bucket = self.buckets[key]
-            
-            # Leak (process) requests from queue
-            time_passed = current_time - bucket['last_leak']
-            requests_to_leak = int(time_passed * self.leak_rate)
-            
-            for _ in range(min(requests_to_leak, len(bucket['queue']))):
-                bucket['queue'].popleft()
-            
-            bucket['last_leak'] = current_time
-            
-            # Check if we can add new request to queue
-            if len(bucket['queue']) < self.capacity:
-                bucket['queue'].append(current_time)
-                return True
-            
-            return False
+        lock, buckets = self._shards[hash(key) & _SHARD_MASK]
+        with lock:
+            return self._check_locked(buckets, key, self._now())
+    
+    def check(self, key: str) -> Tuple[bool, Dict]:
+        """
+        Decide on one request and return the stats that decision saw,
+        from a single locked section
+        """
+        lock, buckets = self._shards[hash(key) & _SHARD_MASK]
+        with lock:
+            current_time = self._now()
+            allowed = self._check_locked(buckets, key, current_time)
+            return allowed, self._stats_locked(buckets.get(key), current_time)
     
     def get_stats(self, key: str) -> Dict:
-        bucket = self.buckets[key]
+        lock, buckets = self._shards[hash(key) & _SHARD_MASK]
+        with lock:
+            return self._stats_locked(buckets.get(key), self._now())
+    
+    def _check_locked(self, buckets: Dict[str, _LeakyBucketState], key: str, current_time: int) -> bool:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = _LeakyBucketState(current_time)
+        
+        # Leak (process) requests from queue. An empty queue has nothing to
+        # drain; otherwise last_leak only advances once a whole unit has
+        # leaked, so sub-unit intervals accumulate instead of truncating to 0
+        level = bucket.level
+        if level:
+            leaked = int((current_time - bucket.last_leak) * self.leak_rate)
+            if leaked:
+                level -= leaked
+                if level < 0:
+                    level = 0
+                bucket.last_leak = current_time
+        else:
+            bucket.last_leak = current_time
+        
+        # Check if we can add new request to queue
+        if level + _NS_PER_SEC <= self._capacity_units:
+            bucket.level = level + _NS_PER_SEC
+            return True
+        
+        bucket.level = level
+        return False
+    
+    def _stats_locked(self, bucket: Optional[_LeakyBucketState], current_time: int) -> Dict:
+        bucket = bucket or _LeakyBucketState(current_time)
         return {
-            'queue_size': len(bucket['queue']),
+            'queue_size': -(-bucket.level // _NS_PER_SEC),  # partly drained requests still count
             'capacity': self.capacity,
             'leak_rate': self.leak_rate,
-            'last_leak': bucket['last_leak']
+            'last_leak': bucket.last_leak
         }
+    
+    def evict_idle(self) -> int:
+        """
+        Forget keys whose state is indistinguishable from a fresh key
+        (the queue has fully drained); returns the number of keys evicted
+        """
+        current_time = self._now()
+        leak_rate = self.leak_rate
+        return _evict_idle(self._shards, lambda bucket: (
+            bucket.level <= (current_time - bucket.last_leak) * leak_rate))
+
+
+# Lua scripts for the Redis-backed limiters. Each runs atomically on the
+# server in one EVAL round trip; times are Redis server microseconds, so
+# clients need no synchronised clocks. A ttl of 0 disables expiry. Each
+# returns {allowed, level as a string, now}: Redis would truncate a float.
+_REDIS_TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local ttl_ms = tonumber(ARGV[4])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000000 + tonumber(time[2])
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'last_refill')
+local tokens = tonumber(bucket[1]) or capacity
+local last_refill = tonumber(bucket[2]) or now
+if now > last_refill then
+    tokens = math.min(capacity, tokens + (now - last_refill) * refill_rate / 1000000)
+end
+
+local allowed = 0
+if tokens >= requested then
+    tokens = tokens - requested
+    allowed = 1
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'last_refill', now)
+if ttl_ms > 0 then
+    redis.call('PEXPIRE', KEYS[1], ttl_ms)
+end
+return {allowed, tostring(tokens), now}
+"""
+
+_REDIS_LEAKY_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local leak_rate = tonumber(ARGV[2])
+local ttl_ms = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000000 + tonumber(time[2])
+
+local bucket = redis.call('HMGET', KEYS[1], 'level', 'last_leak')
+local level = tonumber(bucket[1]) or 0
+local last_leak = tonumber(bucket[2]) or now
+if now > last_leak then
+    level = math.max(0, level - (now - last_leak) * leak_rate / 1000000)
+end
+
+local allowed = 0
+if level + 1 <= capacity then
+    level = level + 1
+    allowed = 1
+end
+
+redis.call('HSET', KEYS[1], 'level', level, 'last_leak', now)
+if ttl_ms > 0 then
+    redis.call('PEXPIRE', KEYS[1], ttl_ms)
+end
+return {allowed, tostring(level), now}
+"""
+
+
+def _ttl_ms(amount: float, rate: float) -> int:
+    """Milliseconds for `amount` to drain or refill at `rate`/s (0 = never expire)"""
+    return max(1, math.ceil(amount / rate * 1000)) if rate > 0 else 0
+
+
+class RedisTokenBucketRateLimiter:
+    """
+    Token Bucket Algorithm backed by Redis
+    - Limits are shared by every process using the same Redis server
+    - One atomic EVAL per request (refill, check and update in Lua)
+    - Keys expire once the bucket would be full again, bounding Redis memory
+    - `client` is a redis-py client (anything with register_script/hmget)
+    - Redis keys are strings, so keys are compared by str(): 42 and '42'
+      share a bucket
+    """
+    
+    def __init__(self, client, capacity: int, refill_rate: float,
+                 prefix: str = 'ratelimit:token_bucket:'):
+        self.capacity = capacity  # max tokens in bucket
+        self.refill_rate = refill_rate  # tokens per second
+        self.prefix = prefix
+        self._client = client
+        self._script = client.register_script(_REDIS_TOKEN_BUCKET_LUA)
+        self._ttl_ms = _ttl_ms(capacity, refill_rate)
+    
+    def is_allowed(self, key: str, tokens_requested: int = 1) -> bool:
+        return self._eval(key, tokens_requested)[0] == 1
+    
+    def check(self, key: str, tokens_requested: int = 1) -> Tuple[bool, Dict]:
+        """
+        Decide on one request and return the stats that decision saw,
+        from the same EVAL
+        """
+        allowed, tokens, now = self._eval(key, tokens_requested)
+        return allowed == 1, self._stats(tokens, now)
+    
+    def get_stats(self, key: str) -> Dict:
+        return self._stats(*self._client.hmget(f'{self.prefix}{key}', 'tokens', 'last_refill'))
+    
+    def _eval(self, key: str, tokens_requested: int) -> List:
+        return self._script(keys=[f'{self.prefix}{key}'],
+                            args=[self.capacity, self.refill_rate, tokens_requested, self._ttl_ms])
+    
+    def _stats(self, tokens, last_refill) -> Dict:
+        return {
+            'available_tokens': float(tokens) if tokens is not None else float(self.capacity),
+            'capacity': self.capacity,
+            'refill_rate': self.refill_rate,
+            'last_refill': int(float(last_refill)) if last_refill is not None else None  # server us
+        }
+    
+    def evict_idle(self) -> int:
+        """
+        Nothing to sweep: Redis expires each key once its state is back to
+        a fresh key's; returns 0 so IdleKeySweeper can include this limiter
+        """
+        return 0
+
+
+class RedisLeakyBucketRateLimiter:
+    """
+    Leaky Bucket Algorithm backed by Redis
+    - Limits are shared by every process using the same Redis server
+    - One atomic EVAL per request; the queue level drains at leak_rate
+    - Keys expire once the queue would have drained, bounding Redis memory
+    - `client` is a redis-py client (anything with register_script/hmget)
+    - Redis keys are strings, so keys are compared by str(): 42 and '42'
+      share a bucket
+    """
+    
+    def __init__(self, client, capacity: int, leak_rate: float,
+                 prefix: str = 'ratelimit:leaky_bucket:'):
+        self.capacity = capacity  # max queue size
+        self.leak_rate = leak_rate  # requests processed per second
+        self.prefix = prefix
+        self._client = client
+        self._script = client.register_script(_REDIS_LEAKY_BUCKET_LUA)
+        self._ttl_ms = _ttl_ms(capacity, leak_rate)
+    
+    def is_allowed(self, key: str) -> bool:
+        return self._eval(key)[0] == 1
+    
+    def check(self, key: str) -> Tuple[bool, Dict]:
+        """
+        Decide on one request and return the stats that decision saw,
+        from the same EVAL
+        """
+        allowed, level, now = self._eval(key)
+        return allowed == 1, self._stats(level, now)
+    
+    def get_stats(self, key: str) -> Dict:
+        return self._stats(*self._client.hmget(f'{self.prefix}{key}', 'level', 'last_leak'))
+    
+    def _eval(self, key: str) -> List:
+        return self._script(keys=[f'{self.prefix}{key}'],
+                            args=[self.capacity, self.leak_rate, self._ttl_ms])
+    
+    def _stats(self, level, last_leak) -> Dict:
+        return {
+            'queue_size': math.ceil(float(level)) if level is not None else 0,
+            'capacity': self.capacity,
+            'leak_rate': self.leak_rate,
+            'last_leak': int(float(last_leak)) if last_leak is not None else None  # server us
+        }
+    
+    def evict_idle(self) -> int:
+        """
+        Nothing to sweep: Redis expires each key once its state is back to
+        a fresh key's; returns 0 so IdleKeySweeper can include this limiter
+        """
+        return 0
+
+
+# Strategy name -> limiter class, used by make_limiter()
+LIMITER_STRATEGIES = {
+    'fixed_window': FixedWindowRateLimiter,
+    'sliding_log': SlidingWindowLogRateLimiter,
+    'sliding_counter': SlidingWindowCounterRateLimiter,
+    'token_bucket': TokenBucketRateLimiter,
+    'leaky_bucket': LeakyBucketRateLimiter,
+    'redis_token_bucket': RedisTokenBucketRateLimiter,
+    'redis_leaky_bucket': RedisLeakyBucketRateLimiter,
+}
+
+
+def make_limiter(strategy: str = 'sliding_counter', **kwargs):
+    """
+    Create a rate limiter by strategy name, passing kwargs to its constructor
+    - 'sliding_counter' (default): constant memory per key, small bounded error
+    - 'sliding_log': exact, but memory grows with the limit; opt in for audits
+    - 'fixed_window', 'token_bucket', 'leaky_bucket': see the classes above
+    - 'redis_token_bucket', 'redis_leaky_bucket': shared across processes;
+      pass client=redis.Redis(...)
+    """
+    try:
+        limiter_class = LIMITER_STRATEGIES[strategy]
+    except KeyError:
+        raise ValueError(f"Unknown rate limiting strategy: {strategy!r}") from None
+    return limiter_class(**kwargs)
+
+
+class IdleKeySweeper:
+    """
+    Background thread that periodically calls evict_idle() on limiters
+    - Bounds memory by recently active keys instead of every key ever seen
+    - Eviction only drops state equal to a fresh key's, so limits are unchanged
+    """
+    
+    def __init__(self, *limiters, interval: float = 60.0):
+        self.limiters = limiters
+        self.interval = interval  # in seconds
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='ratelimit-sweeper', daemon=True)
+    
+    def start(self) -> 'IdleKeySweeper':
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        """Stop sweeping; safe to call before start() or more than once"""
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+    
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            for limiter in self.limiters:
+                try:
+                    limiter.evict_idle()
+                except Exception:
+                    # Keep sweeping the other limiters, and this one next time
+                    logger.exception("evict_idle() failed for %r", limiter)
 
 
 # Demonstration and Testing
@@ -258,8 +1013,7 @@ def test_rate_limiters():
     
     # Make 5 requests quickly
     for i in range(7):
-        allowed = fixed_limiter.is_allowed("user1")
-        stats = fixed_limiter.get_stats("user1")
+        allowed, stats = fixed_limiter.check("user1")
         print(f"Request {i+1}: {'✓ Allowed' if allowed else '✗ Denied'} "
               f"({stats['requests_made']}/{stats['limit']})")
         if i == 4:  # After 5th request, wait for next window
@@ -276,22 +1030,19 @@ def test_rate_limiters():
     # Burst of 5 requests
     print("Making 5 requests quickly (burst):")
     for i in range(5):
-        allowed = token_limiter.is_allowed("user2")
-        stats = token_limiter.get_stats("user2")
+        allowed, stats = token_limiter.check("user2")
         print(f"Request {i+1}: {'✓ Allowed' if allowed else '✗ Denied'} "
               f"(Tokens: {stats['available_tokens']:.1f})")
     
     # 6th request should be denied
-    allowed = token_limiter.is_allowed("user2")
-    stats = token_limiter.get_stats("user2")
+    allowed, stats = token_limiter.check("user2")
     print(f"Request 6: {'✓ Allowed' if allowed else '✗ Denied'} "
           f"(Tokens: {stats['available_tokens']:.1f})")
     
     # Wait and try again
     print("Waiting 3 seconds for token refill...")
     time.sleep(3)
-    allowed = token_limiter.is_allowed("user2")
-    stats = token_limiter.get_stats("user2")
+    allowed, stats = token_limiter.check("user2")
     print(f"After wait: {'✓ Allowed' if allowed else '✗ Denied'} "
           f"(Tokens: {stats['available_tokens']:.1f})")
     
@@ -303,8 +1054,7 @@ def test_rate_limiters():
     sliding_limiter = SlidingWindowLogRateLimiter(limit=3, window_size=5)
     
     for i in range(5):
-        allowed = sliding_limiter.is_allowed("user3")
-        stats = sliding_limiter.get_stats("user3")
+        allowed, stats = sliding_limiter.check("user3")
         print(f"Request {i+1}: {'✓ Allowed' if allowed else '✗ Denied'} "
               f"({stats['requests_made']}/{stats['limit']})")
         if i == 2:  # After 3rd request
@@ -320,7 +1070,7 @@ def test_rate_limiters():
     
     # Initialize all limiters with same logical limit
     fixed = FixedWindowRateLimiter(limit=10, window_size=60)
-    sliding = SlidingWindowLogRateLimiter(limit=10, window_size=60)
+    sliding = make_limiter(limit=10, window_size=60)
     token = TokenBucketRateLimiter(capacity=10, refill_rate=10/60)  # 10 tokens per minute
     leaky = LeakyBucketRateLimiter(capacity=10, leak_rate=10/60)  # 10 requests per minute
     
@@ -353,17 +1103,17 @@ def usage_examples():
     
     # API Rate Limiting
     print("API Rate Limiting Example:")
-    api_limiter = TokenBucketRateLimiter(capacity=100, refill_rate=10)  # 100 burst, 10/sec sustained
+    api_limiter = make_limiter(limit=100, window_size=10)  # 100 requests per 10 seconds
     
     def api_endpoint(user_id: str, endpoint: str):
         key = f"{user_id}:{endpoint}"
-        if api_limiter.is_allowed(key):
+        allowed, stats = api_limiter.check(key)
+        if allowed:
             return {"status": "success", "data": "API response"}
         else:
-            stats = api_limiter.get_stats(key)
             return {
                 "status": "rate_limited", 
-                "message": f"Rate limit exceeded. Available tokens: {stats['available_tokens']:.1f}"
+                "message": f"Rate limit exceeded. Remaining: {stats['remaining']:.1f}"
             }
     
     # Simulate API calls
@@ -375,7 +1125,7 @@ def usage_examples():
     
     # Login Attempt Rate Limiting
     print("Login Attempt Rate Limiting:")
-    login_limiter = FixedWindowRateLimiter(limit=5, window_size=300)  # 5 attempts per 5 minutes
+    login_limiter = make_limiter(limit=5, window_size=300)  # 5 attempts per 5 minutes
     
     def login_attempt(username: str):
         if login_limiter.is_allowed(f"login:{username}"):
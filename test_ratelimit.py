@@ -0,0 +1,484 @@
+"""
+Tests for ratelimit.py
+- Every limiter runs on a fake clock against a straightforward reference
+  model of its algorithm, kept in exact arithmetic
+- Time steps are whole milliseconds and rates are powers of two, so the
+  limiters' fixed-point arithmetic is exact and decisions must match
+"""
+import random
+import threading
+import time
+from fractions import Fraction
+
+import pytest
+
+import ratelimit
+from ratelimit import (
+    FixedWindowRateLimiter,
+    SlidingWindowLogRateLimiter,
+    SlidingWindowCounterRateLimiter,
+    TokenBucketRateLimiter,
+    LeakyBucketRateLimiter,
+    RedisTokenBucketRateLimiter,
+    RedisLeakyBucketRateLimiter,
+    IdleKeySweeper,
+)
+
+
+NS_PER_MS = 1_000_000
+NS_PER_SEC = 1_000_000_000
+START_NS = 1_000_000 * NS_PER_SEC
+KEYS = ['alice', 'bob', 42, ('carol', '/login')]
+
+
+class FakeClock:
+    def __init__(self, now: int = START_NS):
+        self.now = now
+
+    def __call__(self) -> int:
+        return self.now
+
+    def advance(self, ms: int):
+        self.now += ms * NS_PER_MS
+
+
+def with_clock(limiter, clock: FakeClock):
+    # _now is looked up on the instance first, so this shadows the class clock
+    limiter._now = clock
+    return limiter
+
+
+# Reference models: the textbook algorithms, one key at a time
+class FixedWindowModel:
+    def __init__(self, limit: int, window_size: int):
+        self.limit = limit
+        self.window_ns = window_size * NS_PER_SEC
+        self.counts = {}
+
+    def allow(self, key, now: int) -> bool:
+        window = now // self.window_ns
+        count = self.counts.get((key, window), 0)
+        if count < self.limit:
+            self.counts[key, window] = count + 1
+            return True
+        return False
+
+
+class SlidingLogModel:
+    def __init__(self, limit: int, window_size: int):
+        self.limit = limit
+        self.window_ns = window_size * NS_PER_SEC
+        self.logs = {}
+
+    def allow(self, key, now: int) -> bool:
+        log = self.logs.setdefault(key, [])
+        active = [t for t in log if t >= now - self.window_ns]
+        if len(active) < self.limit:
+            log.append(now)
+            return True
+        return False
+
+
+class SlidingCounterModel:
+    def __init__(self, limit: int, window_size: int):
+        self.limit = limit
+        self.window_ns = window_size * NS_PER_SEC
+        self.counts = {}
+
+    def allow(self, key, now: int) -> bool:
+        window = now // self.window_ns
+        previous = self.counts.get((key, window - 1), 0)
+        current = self.counts.get((key, window), 0)
+        elapsed = Fraction(now % self.window_ns, self.window_ns)
+        if previous * (1 - elapsed) + current < self.limit:
+            self.counts[key, window] = current + 1
+            return True
+        return False
+
+
+class TokenBucketModel:
+    def __init__(self, capacity: int, refill_rate: float):
+        self.capacity = capacity
+        self.refill_rate = Fraction(refill_rate)
+        self.buckets = {}
+
+    def allow(self, key, now: int, tokens_requested: int = 1) -> bool:
+        tokens, last = self.buckets.get(key, (Fraction(self.capacity), now))
+        tokens = min(Fraction(self.capacity),
+                     tokens + Fraction(now - last, NS_PER_SEC) * self.refill_rate)
+        allowed = tokens >= tokens_requested
+        if allowed:
+            tokens -= tokens_requested
+        self.buckets[key] = (tokens, now)
+        return allowed
+
+
+class LeakyBucketModel:
+    def __init__(self, capacity: int, leak_rate: float):
+        self.capacity = capacity
+        self.leak_rate = Fraction(leak_rate)
+        self.buckets = {}
+
+    def allow(self, key, now: int) -> bool:
+        level, last = self.buckets.get(key, (Fraction(0), now))
+        level = max(Fraction(0), level - Fraction(now - last, NS_PER_SEC) * self.leak_rate)
+        allowed = level + 1 <= self.capacity
+        if allowed:
+            level += 1
+        self.buckets[key] = (level, now)
+        return allowed
+
+
+# (limiter class, reference model, constructor args)
+ALGORITHMS = [
+    (FixedWindowRateLimiter, FixedWindowModel, (5, 2)),
+    (SlidingWindowLogRateLimiter, SlidingLogModel, (5, 2)),
+    (SlidingWindowCounterRateLimiter, SlidingCounterModel, (5, 2)),
+    (TokenBucketRateLimiter, TokenBucketModel, (5, 2.0)),
+    (LeakyBucketRateLimiter, LeakyBucketModel, (5, 2.0)),
+]
+ALGORITHM_IDS = [cls.__name__ for cls, _, _ in ALGORITHMS]
+
+
+def random_steps(seed: int, n: int = 3000):
+    """Yield (milliseconds to advance, key): mostly bursts, sometimes long pauses"""
+    rng = random.Random(seed)
+    for _ in range(n):
+        roll = rng.random()
+        if roll < 0.6:
+            ms = 0
+        elif roll < 0.95:
+            ms = rng.randint(1, 500)
+        else:
+            ms = rng.randint(1000, 10_000)
+        yield ms, rng.choice(KEYS)
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('cls, model_cls, args', ALGORITHMS, ids=ALGORITHM_IDS)
+def test_matches_reference_model(cls, model_cls, args, seed):
+    clock = FakeClock()
+    limiter = with_clock(cls(*args), clock)
+    model = model_cls(*args)
+
+    for step, (ms, key) in enumerate(random_steps(seed)):
+        clock.advance(ms)
+        if step % 2:
+            allowed, stats = limiter.check(key)
+            assert isinstance(stats, dict)
+        else:
+            allowed = limiter.is_allowed(key)
+        assert allowed == model.allow(key, clock.now), (step, key)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_token_bucket_multi_token_matches_reference(seed):
+    rng = random.Random(seed)
+    clock = FakeClock()
+    limiter = with_clock(TokenBucketRateLimiter(10, 4.0), clock)
+    model = TokenBucketModel(10, 4.0)
+
+    for ms, key in random_steps(seed):
+        clock.advance(ms)
+        tokens = rng.randint(1, 4)
+        assert limiter.is_allowed(key, tokens) == model.allow(key, clock.now, tokens)
+
+
+def test_token_bucket_rejects_negative_requests():
+    clock = FakeClock()
+    limiter = with_clock(TokenBucketRateLimiter(5, 1.0), clock)
+    with pytest.raises(ValueError, match='tokens_requested'):
+        limiter.is_allowed('alice', -100)
+    with pytest.raises(ValueError, match='tokens_requested'):
+        limiter.check('alice', -1)
+
+    assert [limiter.is_allowed('alice') for _ in range(6)] == [True] * 5 + [False]
+
+
+@pytest.mark.parametrize('cls, model_cls, args', ALGORITHMS, ids=ALGORITHM_IDS)
+def test_eviction_does_not_change_decisions(cls, model_cls, args):
+    clock = FakeClock()
+    limiter = with_clock(cls(*args), clock)
+    model = model_cls(*args)
+    rng = random.Random(7)
+    evicted = 0
+
+    for ms, key in random_steps(7):
+        clock.advance(ms)
+        assert limiter.is_allowed(key) == model.allow(key, clock.now)
+        if rng.random() < 0.05:
+            evicted += limiter.evict_idle()
+
+    assert evicted > 0
+    clock.advance(60_000)
+    limiter.evict_idle()
+    assert all(not table for _, table in limiter._shards)
+
+
+@pytest.mark.parametrize('cls', [FixedWindowRateLimiter, TokenBucketRateLimiter])
+def test_batch_matches_sequential_calls(cls):
+    clock = FakeClock()
+    batched = with_clock(cls(5, 2), clock)
+    sequential = with_clock(cls(5, 2), clock)
+    rng = random.Random(3)
+
+    for _ in range(200):
+        clock.advance(rng.choice([0, 0, 100, 700, 3000]))
+        keys = [rng.choice(KEYS) for _ in range(rng.randint(0, 12))]
+        assert batched.is_allowed_batch(keys) == [sequential.is_allowed(key) for key in keys]
+
+
+def test_fixed_window_limit_must_fit_packed_count():
+    FixedWindowRateLimiter(2 ** 32 - 1, 60)
+    with pytest.raises(ValueError, match='limit'):
+        FixedWindowRateLimiter(2 ** 32, 60)
+
+
+@pytest.mark.parametrize('cls', [cls for cls, _, _ in ALGORITHMS], ids=ALGORITHM_IDS)
+def test_zero_limit_denies_everything(cls):
+    clock = FakeClock()
+    limiter = with_clock(cls(0, 1), clock)
+
+    for _ in range(3):
+        assert not limiter.is_allowed('alice')
+        allowed, _ = limiter.check('alice')
+        assert not allowed
+        clock.advance(5000)
+
+    limiter.evict_idle()
+    assert all(not table for _, table in limiter._shards)
+
+
+def test_sliding_log_grows_with_use_not_limit():
+    clock = FakeClock()
+    limiter = with_clock(SlidingWindowLogRateLimiter(10 ** 6, 60), clock)
+    for _ in range(3):
+        assert limiter.is_allowed('alice')
+
+    _, logs = limiter._shards[hash('alice') & ratelimit._SHARD_MASK]
+    assert len(logs['alice'].ring) == 3
+    assert limiter.get_stats('alice')['requests_made'] == 3
+
+
+def test_stats_after_requests():
+    clock = FakeClock()
+    limiters = [with_clock(cls(*args), clock) for cls, _, args in ALGORITHMS]
+    for limiter in limiters:
+        for _ in range(3):
+            limiter.is_allowed('alice')
+
+    fixed, log, counter, token, leaky = (limiter.get_stats('alice') for limiter in limiters)
+    assert fixed['requests_made'] == 3 and fixed['remaining'] == 2
+    assert log['requests_made'] == 3 and log['oldest_request'] == START_NS
+    assert counter['current_window_requests'] == 3
+    assert token['available_tokens'] == 2.0
+    assert leaky['queue_size'] == 3
+
+
+def table_size(limiter) -> int:
+    return sum(len(table) for _, table in limiter._shards)
+
+
+def test_admission_filter_needs_limit_of_two():
+    limiter = FixedWindowRateLimiter(1, 60, admission_filter_keys=1000)
+    assert limiter._filters == [None] * ratelimit._NUM_SHARDS
+    assert all(limiter.is_allowed(f'user:{i}') for i in range(20000))
+
+
+@pytest.mark.parametrize('fp_rate', [0, 1, 1.5, -0.1])
+def test_admission_filter_rejects_invalid_fp_rate(fp_rate):
+    with pytest.raises(ValueError, match='admission_filter_fp_rate'):
+        FixedWindowRateLimiter(5, 60, admission_filter_keys=1000, admission_filter_fp_rate=fp_rate)
+
+
+def test_admission_filter_false_positive_rate():
+    clock = FakeClock()
+    limiter = with_clock(FixedWindowRateLimiter(2, 60, admission_filter_keys=20000), clock)
+    keys = [f'user:{i}' for i in range(20000)]
+
+    assert all(limiter.is_allowed(key) for key in keys)
+    # Only false positives, and keys past a full shard's capacity, get an entry
+    assert table_size(limiter) < 1000
+    assert limiter.get_stats('user:7')['requests_made'] == 1
+
+    denied = sum(not limiter.is_allowed(key) for key in keys)
+    assert denied < 200
+
+
+def test_admission_filter_uses_all_its_bits():
+    # Larger than 2**24 bits: the probes must reach past the first 16M
+    admission = ratelimit._AdmissionFilter(200_000, 1e-4)
+    assert admission.size > 1 << 24
+    for i in range(200_000):
+        admission.admit(hash(f'user:{i}'), 0)
+
+    false_positives = sum(admission.contains(hash(f'other:{i}')) for i in range(100_000))
+    assert false_positives < 20
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_admission_filter_never_exceeds_limit(seed):
+    # A tiny, overfull filter with a high false positive rate
+    clock = FakeClock()
+    limiter = with_clock(FixedWindowRateLimiter(3, 2, admission_filter_keys=64,
+                                                admission_filter_fp_rate=0.5), clock)
+    rng = random.Random(seed)
+    admitted = {}
+
+    for ms, _ in random_steps(seed):
+        clock.advance(ms)
+        key = rng.randrange(300)
+        window = clock.now // (2 * NS_PER_SEC)
+        count = admitted.get((key, window), 0)
+        allowed = limiter.is_allowed(key)
+        if count == 0:
+            assert allowed  # a key's first request in a window is always allowed
+        if allowed:
+            admitted[key, window] = count + 1
+            assert count < 3
+
+
+def test_admission_filter_late_clock_reading():
+    window_ns = 60 * NS_PER_SEC
+    clock = FakeClock((START_NS // window_ns + 1) * window_ns)  # a window boundary
+    limiter = with_clock(FixedWindowRateLimiter(3, 60, admission_filter_keys=1000), clock)
+    assert limiter.is_allowed('alice')  # admitted through the filter only
+
+    # A thread that read the clock just before the window changed
+    clock.now -= 1
+    assert [limiter.is_allowed('alice') for _ in range(3)] == [True, True, False]
+    clock.now += 1
+    assert not limiter.is_allowed('alice')
+
+
+def test_make_limiter_defaults_to_sliding_window_counter():
+    limiter = ratelimit.make_limiter(limit=10, window_size=60)
+    assert type(limiter) is SlidingWindowCounterRateLimiter
+    assert (limiter.limit, limiter.window_size) == (10, 60)
+
+
+@pytest.mark.parametrize('strategy, kwargs', [
+    ('fixed_window', {'limit': 3, 'window_size': 5}),
+    ('sliding_log', {'limit': 3, 'window_size': 5}),
+    ('sliding_counter', {'limit': 3, 'window_size': 5}),
+    ('token_bucket', {'capacity': 3, 'refill_rate': 0.5}),
+    ('leaky_bucket', {'capacity': 3, 'leak_rate': 0.5}),
+])
+def test_make_limiter_passes_kwargs_to_strategy(strategy, kwargs):
+    limiter = ratelimit.make_limiter(strategy, **kwargs)
+    assert type(limiter) is ratelimit.LIMITER_STRATEGIES[strategy]
+    for name, value in kwargs.items():
+        assert getattr(limiter, name) == value
+
+
+def test_make_limiter_rejects_unknown_strategy():
+    with pytest.raises(ValueError, match='no_such_strategy'):
+        ratelimit.make_limiter('no_such_strategy', limit=1, window_size=1)
+
+
+class BrokenLimiter:
+    def evict_idle(self) -> int:
+        raise RuntimeError('boom')
+
+
+class CountingLimiter:
+    def __init__(self):
+        self.swept = threading.Event()
+
+    def evict_idle(self) -> int:
+        self.swept.set()
+        return 0
+
+
+def test_sweeper_survives_a_failing_limiter(caplog):
+    counting = CountingLimiter()
+    sweeper = IdleKeySweeper(BrokenLimiter(), counting, interval=0.01).start()
+    try:
+        assert counting.swept.wait(2)
+        counting.swept.clear()
+        assert counting.swept.wait(2)  # still sweeping after the failure
+    finally:
+        sweeper.stop()
+
+    assert not sweeper._thread.is_alive()
+    assert 'evict_idle() failed' in caplog.text
+
+
+def test_sweeper_stop_is_safe_before_start_and_twice():
+    sweeper = IdleKeySweeper(CountingLimiter(), interval=0.01)
+    sweeper.stop()
+    sweeper.stop()
+
+
+# The Redis limiters read the server clock, so these tests use real time
+# with fast rates. fakeredis[lua] runs the scripts in-process.
+@pytest.fixture
+def redis_client():
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')
+    return fakeredis.FakeRedis()
+
+
+@pytest.mark.parametrize('cls', [RedisTokenBucketRateLimiter, RedisLeakyBucketRateLimiter])
+def test_redis_limiter_denies_then_recovers(redis_client, cls):
+    limiter = cls(redis_client, 2, 20.0)  # one request back every 50 ms
+    assert [limiter.is_allowed('alice') for _ in range(3)] == [True, True, False]
+    assert limiter.is_allowed('bob')
+
+    time.sleep(0.06)
+    assert limiter.is_allowed('alice')
+    assert not limiter.is_allowed('alice')
+
+
+def test_redis_token_bucket_multi_token_request(redis_client):
+    limiter = RedisTokenBucketRateLimiter(redis_client, 3, 1.0)
+    assert not limiter.is_allowed('alice', 4)
+    assert limiter.is_allowed('alice', 3)
+    assert not limiter.is_allowed('alice')
+    assert limiter.get_stats('alice')['available_tokens'] < 1
+
+
+@pytest.mark.parametrize('cls', [RedisTokenBucketRateLimiter, RedisLeakyBucketRateLimiter])
+def test_redis_keys_expire_once_idle(redis_client, cls):
+    limiter = cls(redis_client, 2, 20.0)
+    limiter.is_allowed('alice')
+    redis_key = limiter.prefix + 'alice'
+    assert 0 < redis_client.pttl(redis_key) <= 100
+
+    time.sleep(0.15)
+    assert not redis_client.exists(redis_key)
+    assert limiter.evict_idle() == 0
+
+
+@pytest.mark.parametrize('cls', [RedisTokenBucketRateLimiter, RedisLeakyBucketRateLimiter])
+def test_redis_limiter_accepts_non_str_keys(redis_client, cls):
+    limiter = cls(redis_client, 1, 1.0)
+    for key in (42, ('carol', '/login')):
+        assert limiter.is_allowed(key)
+        assert not limiter.is_allowed(key)
+        assert limiter.get_stats(key)['capacity'] == 1
+
+    # Redis keys are strings, so keys are compared by str()
+    assert not limiter.is_allowed('42')
+
+
+def test_redis_token_bucket_check(redis_client):
+    limiter = ratelimit.make_limiter('redis_token_bucket', client=redis_client,
+                                     capacity=2, refill_rate=0.001)
+    allowed, stats = limiter.check('alice')
+    assert allowed
+    assert 1.0 <= stats['available_tokens'] < 1.01
+    assert stats['last_refill'] == limiter.get_stats('alice')['last_refill']
+
+    allowed, stats = limiter.check('alice', 2)
+    assert not allowed
+    assert stats['available_tokens'] == pytest.approx(limiter.get_stats('alice')['available_tokens'])
+
+
+def test_redis_leaky_bucket_check(redis_client):
+    limiter = ratelimit.make_limiter('redis_leaky_bucket', client=redis_client,
+                                     capacity=2, leak_rate=0.001)
+    assert [limiter.check('alice')[1]['queue_size'] for _ in range(2)] == [1, 2]
+    allowed, stats = limiter.check('alice')
+    assert not allowed
+    assert stats == limiter.get_stats('alice')